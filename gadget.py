@@ -9,17 +9,55 @@ from garuda.garudaclientbackend import GarudaClientBackend
 from itertools import count
 
 import glob
+import time
 import http.client
+import xml.parsers.expat
+
+# The NumPy edge-list export and KO matrix are optional; without NumPy only the KGML is downloaded
+try:
+    import kgml_export
+    import ko_matrix
+except ImportError:
+    kgml_export = None
+    ko_matrix = None
+
+# Classes a downloaded pathway can end up in
+KGML_OK = "ok"                # well-formed KGML, saved as <pathid>.xml
+KGML_NONE = "no-KGML"         # KEGG has no KGML for this pathway (e.g. global maps)
+KGML_TRANSIENT = "transient"  # server or network trouble, worth retrying
+KGML_FATAL = "fatal"          # unexpected answer that a retry will not fix
+
+KGML_CONTENT_TYPES = ("text/xml", "application/xml")
+KGML_CHUNK_SIZE = 8192
+KGML_RETRIES = 3
+KGML_RETRY_WAIT = 2
+KGML_TIMEOUT = 30             # seconds without data before a download counts as transient
+
+# Local copy of KEGG /list/organism and how long (seconds) it is trusted before a refresh
+ORGANISM_CACHE = "organism_list.tsv"
+ORGANISM_TTL = 7 * 24 * 60 * 60
+ORGANISM_TIMEOUT = 30
 
 class GarudaCommunicationHandler():
 
     backend = None
-    gadgetMap = {}
     loopBreak = True
+    fanoutRetries = 3
 
     def __init__(self, gadget_name, gadget_id, *args, **kwargs):
         self.gadget_name = gadget_name
         self.gadget_id = gadget_id
+        # Choices offered for the last compatible gadget list
+        self.gadgetMap = {}
+        # State of the current fan-out: the data being sent, the targets of the
+        # current round keyed by gadget id, the ids that have answered in this round,
+        # the ids already confirmed by Garuda, and the response codes that named no target
+        self.fanoutData = []
+        self.fanoutTargets = {}
+        self.fanoutAnswered = set()
+        self.fanoutSucceeded = {}
+        self.fanoutUnattributed = []
+        self.fanoutAttempt = 0
         self.init_backend()
 
     def init_backend(self):
@@ -49,19 +87,24 @@ class GarudaCommunicationHandler():
                 self.backend.response_load_gadget(gadget.gadget_name, gadget.gadget_id, Garuda.RESPCODE_SUCCESS)
                 
         elif message_id == Garuda.ID_GET_COMPATIBLE_GADGET_LIST_RESPONSE:
-            if response_code == str(Garuda.RESPCODE_SUCCESS):
+            if str(response_code) == str(Garuda.RESPCODE_SUCCESS):
                 gadgets = self.backend.get_compatible_gadget_list()
                 if gadgets:
+                    self.gadgetMap = {}
                     count = 0
                     for gadget in gadgets:
                         count += 1
                         self.gadgetMap[str(count)] = gadget
                         print("Select " + str(count) + " for sending Data to "+ gadget.gadget_name )
-                    gadgetIndex = input("Enter your choice: ")
-                    selectedGadget = self.gadgetMap[gadgetIndex]
-                    if selectedGadget:
+                    print("Select a for sending Data to all of them")
+                    gadgetIndex = input("Enter your choice (several numbers may be separated by commas): ")
+                    if gadgetIndex.strip() == 'a':
+                        selectedGadgets = list(self.gadgetMap.values())
+                    else:
+                        selectedGadgets = [self.gadgetMap.get(x.strip()) for x in gadgetIndex.split(",")]
+                    if selectedGadgets and all(selectedGadgets):
                         data = [os.path.abspath(x) for x in glob.glob("*.xml")]
-                        self.backend.send_data_to_gadget(data, selectedGadget.gadget_name, selectedGadget.gadget_id, False)
+                        self.send_data_to_gadgets(data, selectedGadgets)
                     else:
                         print("Invalid Input!!!")
                     
@@ -71,11 +114,14 @@ class GarudaCommunicationHandler():
                 pass
 
         elif message_id == Garuda.ID_SEND_DATA_GADGET_RESPONSE:
-            if response_code == str(Garuda.RESPCODE_SUCCESS):
+            # The SDK passes the result code on as it was received, which may be an int
+            success = str(response_code) == str(Garuda.RESPCODE_SUCCESS)
+            if success:
                 print("Received response for 'Send Data' request ...")
             else:
                 print("Send data gadget Error: ", response_code)
-            self.loopBreak = False
+            target = param.gadget_id if isinstance(param, Garuda.Gadget) else None
+            self.handle_fanout_response(target, success)
 
         elif message_id == Garuda.ID_LOAD_DATA_STREAM_REQUEST:  # is stream
             if not isinstance(param, dict):
@@ -102,6 +148,61 @@ class GarudaCommunicationHandler():
         elif message_id == Garuda.ID_JSON_DUMPS_ERROR:
             print("Json dumps error!")
 
+    # Sends the same data to every target gadget without waiting for the responses in between,
+    # so the whole hand-off takes as long as the slowest target
+    def send_data_to_gadgets(self, data, gadgets):
+        self.fanoutData = data
+        self.fanoutSucceeded = {}
+        self.fanoutAttempt = 0
+        self.start_fanout_round(gadgets)
+
+    def start_fanout_round(self, gadgets):
+        self.fanoutTargets = dict((gadget.gadget_id, gadget) for gadget in gadgets)
+        self.fanoutAnswered = set()
+        self.fanoutUnattributed = []
+        self.fanoutAttempt += 1
+        for gadget in self.fanoutTargets.values():
+            print("Sending Data to " + gadget.gadget_name)
+            self.backend.send_data_to_gadget(self.fanoutData, gadget.gadget_name, gadget.gadget_id, False)
+
+    # Records the answer of one target of the current round.
+    # Answers from targets that are not pending in this round (e.g. late replies to an earlier round) are ignored.
+    # Answers without a target are only counted: once every pending target can be matched with one,
+    # the pending targets are credited as successful if all of those answers were successes
+    def handle_fanout_response(self, target, success):
+        pending = [x for x in self.fanoutTargets if x not in self.fanoutAnswered]
+        if not pending:
+            return
+        if target is None:
+            self.fanoutUnattributed.append(success)
+        elif target in pending:
+            self.fanoutAnswered.add(target)
+            pending.remove(target)
+            if success:
+                self.fanoutSucceeded[target] = self.fanoutTargets[target]
+        else:
+            return
+        if pending and len(self.fanoutUnattributed) >= len(pending):
+            for gadget_id in pending:
+                self.fanoutAnswered.add(gadget_id)
+                if all(self.fanoutUnattributed):
+                    self.fanoutSucceeded[gadget_id] = self.fanoutTargets[gadget_id]
+            pending = []
+        if not pending:
+            self.finish_fanout_round()
+
+    # Called once every target of the current round has answered.
+    # Targets that were not confirmed are sent the data again; confirmed ones are left alone
+    def finish_fanout_round(self):
+        failed = [gadget for gadget_id, gadget in self.fanoutTargets.items() if gadget_id not in self.fanoutSucceeded]
+        if failed and self.fanoutAttempt <= self.fanoutRetries:
+            print("Retrying 'Send Data' for " + ", ".join(gadget.gadget_name for gadget in failed))
+            self.start_fanout_round(failed)
+            return
+        for gadget in failed:
+            print("Could not send Data to " + gadget.gadget_name)
+        self.loopBreak = False
+
     def get_gadget_list(self, file_extension, file_type):
         self.backend.request_compatible_gadget_list(file_extension, file_type)
 
@@ -111,53 +212,225 @@ class GarudaCommunicationHandler():
         except Exception:
             pass
 
+# Downloads one KGML and validates it while the bytes arrive:
+# the status code and the content type are checked first, then the body is fed
+# chunk by chunk to an expat parser which checks well-formedness and the <pathway> root.
+# The file is only renamed to <pathid>.xml when everything is fine.
+# Returns a (class, detail) tuple
+def fetch_kgml(pathid):
+    partname = pathid + ".xml.part"
+    conn = http.client.HTTPConnection('rest.kegg.jp', timeout=KGML_TIMEOUT)
+    try:
+        conn.request("GET", "/get/" + pathid + "/kgml")
+        re = conn.getresponse()
+        if re.status == 404:
+            return KGML_NONE, "HTTP 404"
+        if re.status == 429 or re.status >= 500:
+            return KGML_TRANSIENT, "HTTP " + str(re.status)
+        if re.status != 200:
+            return KGML_FATAL, "HTTP " + str(re.status)
+        content_type = (re.getheader("Content-Type") or "").split(";")[0].strip()
+        if content_type not in KGML_CONTENT_TYPES:
+            return KGML_FATAL, "Content-Type " + content_type
+
+        roots = []
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = lambda name, attrs: roots.append(name) if not roots else None
+        size = 0
+        with open(partname, "wb") as handle:
+            while True:
+                chunk = re.read(KGML_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                parser.Parse(chunk, False)
+                if roots and roots[0] != "pathway":
+                    return KGML_FATAL, "root element <" + roots[0] + ">"
+                handle.write(chunk)
+            if size == 0:
+                return KGML_NONE, "empty response"
+            parser.Parse(b"", True)
+        if not roots:
+            return KGML_FATAL, "no root element"
+        os.replace(partname, pathid + ".xml")
+        return KGML_OK, str(size) + " bytes"
+    except xml.parsers.expat.ExpatError as what:
+        return KGML_FATAL, "malformed XML: " + str(what)
+    except (http.client.HTTPException, OSError) as what:
+        return KGML_TRANSIENT, str(what)
+    finally:
+        conn.close()
+        if os.path.exists(partname):
+            os.remove(partname)
+
+# Retries transient failures with a growing wait; the other classes are final
+def download_pathway(pathid):
+    for attempt in range(KGML_RETRIES + 1):
+        result, detail = fetch_kgml(pathid)
+        if result != KGML_TRANSIENT or attempt == KGML_RETRIES:
+            return result, detail
+        print("Retrying " + pathid + " (" + detail + ")")
+        time.sleep(KGML_RETRY_WAIT * (attempt + 1))
+
+# Writes one line per pathway (pathway id, class, detail) to <orgid>.manifest.tsv
+def write_manifest(orgid, results):
+    with open(orgid + ".manifest.tsv", "w") as handle:
+        for pathid, result, detail in results:
+            handle.write(pathid + "\t" + result + "\t" + detail + "\n")
+
+# Catalog of KEGG organisms, built from /list/organism and cached in ORGANISM_CACHE.
+# Organism codes and taxonomic groups (every level of the lineage, e.g. "Mammals")
+# are indexed in dicts, so selections can be validated and expanded offline
+class OrganismCatalog():
+
+    def __init__(self, filename=ORGANISM_CACHE, ttl=ORGANISM_TTL):
+        self.filename = filename
+        self.ttl = ttl
+        self.loaded = False
+        self.organisms = {}
+        self.groups = {}
+
+    # Reads the cache, refreshing it from KEGG first when it is missing or older than the TTL.
+    # A stale cache is still used when KEGG cannot be reached
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not path.exists(self.filename) or time.time() - path.getmtime(self.filename) > self.ttl:
+            self.refresh()
+        if path.exists(self.filename):
+            with open(self.filename, encoding='utf-8') as handle:
+                self.index(handle)
+
+    def refresh(self):
+        conn = http.client.HTTPConnection('rest.kegg.jp', timeout=ORGANISM_TIMEOUT)
+        try:
+            conn.request("GET", "/list/organism")
+            re = conn.getresponse()
+            if re.status != 200:
+                print("Could not refresh the KEGG organism list")
+                return
+            body = re.read().decode('utf-8')
+        except (http.client.HTTPException, OSError):
+            print("Could not refresh the KEGG organism list")
+            return
+        finally:
+            conn.close()
+        with open(self.filename + ".part", "w", encoding='utf-8') as handle:
+            handle.write(body)
+        os.replace(self.filename + ".part", self.filename)
+
+    # Each line is: T number, organism code, name, lineage separated by ';'
+    def index(self, lines):
+        self.organisms = {}
+        self.groups = {}
+        for line in lines:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4:
+                continue
+            tnum, code, name, lineage = fields[:4]
+            lineage = lineage.split(";")
+            self.organisms[code] = (tnum, name, lineage)
+            for group in lineage:
+                self.groups.setdefault(group.lower(), []).append(code)
+
+    def is_available(self):
+        self.load()
+        return len(self.organisms) > 0
+
+    def get_organism(self, code):
+        self.load()
+        return self.organisms.get(code.strip().lower(), None)
+
+    def get_group(self, group):
+        self.load()
+        return self.groups.get(group.strip().lower(), [])
+
+    # Expands a comma separated selection of organism codes and taxonomic groups (both case-insensitive).
+    # Returns the organism codes (in order, without duplicates) and the unknown items.
+    # Without a catalog the codes are passed on unchecked
+    def expand(self, selection):
+        codes = []
+        unknown = []
+        for item in [x.strip() for x in selection.split(",") if x.strip()]:
+            if not self.is_available():
+                found = [item]
+            elif item.lower() in self.organisms:
+                found = [item.lower()]
+            else:
+                found = self.get_group(item)
+            if not found:
+                unknown.append(item)
+            for code in found:
+                if code not in codes:
+                    codes.append(code)
+        return codes, unknown
+
+catalog = OrganismCatalog()
+
 def download_kgml(app, orgid):
-    if len(orgid) > 3:
-        print("Your organism code is more than 3alphabet")
-    elif orgid == '1':
+    if orgid == '1':
         app.get_gadget_list("xml", "kgml")
     elif orgid == '0':
         app.terminate()
     else:
-        conn = http.client.HTTPConnection('rest.kegg.jp')
-        conn.request("GET", "/list/pathway/" + orgid)
-        re = conn.getresponse()
-        #print(re.status, re.reason)
-        if re.status == 200:
-            for i in re.readlines():
-                pathid = i.decode('utf-8').split("\t")[0]
-                pathid = pathid.split(":")[1]
-                print("Downloading " + pathid)
-                newconn = http.client.HTTPConnection('rest.kegg.jp')
-                newconn.request("GET", "/get/" + pathid + "/kgml")
-                re = newconn.getresponse()
-                handle = open(pathid+".xml", "w")
-                handle.write(re.read().decode('utf-8'))
-                handle.close()
-            print("finishded downloading for organism " + orgid)
-        else:
-            print("Your organism code is not in KEGG")
+        codes, unknown = catalog.expand(orgid)
+        for item in unknown:
+            print(item + " is not a KEGG organism code or taxonomic group")
+        if unknown:
+            return
+        if len(codes) > 1:
+            print("Downloading KGML for " + str(len(codes)) + " organisms")
+        for code in codes:
+            download_organism(code)
 
-print("Starting KEGG client Gadget ...")
-app = GarudaCommunicationHandler("KeggClientGadget", "4d62b271-d81d-43fb-849f-65063f2e449c") # For 54 server
+def download_organism(orgid):
+    conn = http.client.HTTPConnection('rest.kegg.jp')
+    conn.request("GET", "/list/pathway/" + orgid)
+    re = conn.getresponse()
+    #print(re.status, re.reason)
+    if re.status == 200:
+        results = []
+        for i in re.readlines():
+            pathid = i.decode('utf-8').split("\t")[0]
+            pathid = pathid.split(":")[1]
+            print("Downloading " + pathid)
+            result, detail = download_pathway(pathid)
+            if result != KGML_OK:
+                print("Skipped " + pathid + ": " + result + " (" + detail + ")")
+            results.append((pathid, result, detail))
+        write_manifest(orgid, results)
+        print("finishded downloading for organism " + orgid)
+        pathids = [pathid for pathid, result, detail in results if result == KGML_OK]
+        if kgml_export and pathids:
+            exported = kgml_export.export_organism(orgid, pathids=pathids)
+            if exported:
+                print("Exported edge list to " + exported)
+        if ko_matrix:
+            engine = ko_matrix.KOMatrixEngine()
+            if engine.update_organism(orgid):
+                engine.save()
+                print("Updated KO presence matrix " + engine.filename)
+    else:
+        print("Your organism code is not in KEGG")
 
-userInput = input("Please input 3alphabet KEGG organism code to download KGML, or 1 to send KGMLs, or 0 to Exit:\n")
-if userInput != '0':
+if __name__ == "__main__":
+    print("Starting KEGG client Gadget ...")
+    app = GarudaCommunicationHandler("KeggClientGadget", "4d62b271-d81d-43fb-849f-65063f2e449c") # For 54 server
 
-    download_kgml(app, userInput)
-    moreInput = input("Would you like to download KGML for the other organism? If so, please input 3alphabet KEGG organism code once again, or 1 to send KGMLs, or 0 to Exit:\n")
+    userInput = input("Please input KEGG organism codes or taxonomic groups (comma separated) to download KGML, or 1 to send KGMLs, or 0 to Exit:\n")
+    if userInput != '0':
 
-    if moreInput != '0':
-        download_kgml(app, moreInput)
-    elif len(moreInput) > 3:
-        print("Invalid Input!!!")
-    elif moreInput == '0':
-        app.terminate()
+        download_kgml(app, userInput)
+        moreInput = input("Would you like to download KGML for the other organism? If so, please input KEGG organism codes or taxonomic groups once again, or 1 to send KGMLs, or 0 to Exit:\n")
 
-    while app.loopBreak:
-        continue
+        if moreInput != '0':
+            download_kgml(app, moreInput)
+        elif moreInput == '0':
+            app.terminate()
 
-elif len(userInput) > 3:
-    print("Invalid Input!!!")
-elif userInput == '0':
-    app.terminate()
+        while app.loopBreak:
+            continue
+
+    elif userInput == '0':
+        app.terminate()
@@ -466,6 +466,15 @@ class GarudaClientBackend:
                                 None,
                                 None)
                 self._listner_callback(ID_SEND_DATA_GADGET_RESPONSE, response_code, gadget)
+            elif "targetGadgetID" in json_data["body"]:
+                # Error responses that name their target are passed on with it, so the
+                # gadget can tell which target of a multi-target send has failed
+                gadget = Gadget(json_data["body"].get("targetGadgetName", None),
+                                json_data["body"]["targetGadgetID"],
+                                None,
+                                None,
+                                None)
+                self._listner_callback(ID_SEND_DATA_GADGET_RESPONSE, response_code, gadget)
             else:
                 self._listner_callback(ID_SEND_DATA_GADGET_RESPONSE, response_code, None)
         except Exception as what:
@@ -0,0 +1,292 @@
+# -*- coding:utf-8 -*-
+
+####################################################################################################
+# Columnar export of KGML relation graphs
+# Entries, relations and reactions of downloaded <pathid>.xml files are turned into NumPy arrays
+# which are stored as .npz, or as a directory of memory-mappable .npy files.
+# All strings (entry names, pathway ids, subtypes) are integer-encoded through one shared table,
+# so graphs of different pathways can be merged just by concatenating the arrays.
+####################################################################################################
+
+import os
+import glob
+import xml.etree.ElementTree as ElementTree
+
+from os import path
+
+import numpy as np
+
+# Edge type codes; reversible reactions are stored in both directions
+EDGE_TYPES = ("ECrel", "PPrel", "GErel", "PCrel", "maplink", "reaction")
+EDGE_REACTION = EDGE_TYPES.index("reaction")
+
+# Entry type codes
+NODE_TYPES = ("ortholog", "enzyme", "reaction", "gene", "group", "compound", "map", "brite", "other")
+NODE_OTHER = NODE_TYPES.index("other")
+
+# Arrays of an export
+#   string_data     shared string table (entry names, pathway ids, subtype names) as concatenated UTF-8
+#   string_offsets  string i is string_data[string_offsets[i]:string_offsets[i+1]]
+#   pathways        string id of every exported pathway
+#   node_name       string id of the entry name, e.g. "hsa:5594 hsa:5595"
+#   node_type       NODE_TYPES code
+#   node_pathway    index into pathways
+#   edge_src        index into the node arrays
+#   edge_dst        index into the node arrays
+#   edge_type       EDGE_TYPES code
+#   edge_subtype    string id of the subtype names joined with ',' (reaction name for reactions)
+#   edge_pathway    index into pathways
+#   group_entry     index into the node arrays of a group entry
+#   group_member    index into the node arrays of one of its <component> entries
+ARRAYS = ("string_data", "string_offsets", "pathways",
+          "node_name", "node_type", "node_pathway",
+          "edge_src", "edge_dst", "edge_type", "edge_subtype", "edge_pathway",
+          "group_entry", "group_member")
+
+# String table shared by all pathways of an export
+class StringTable():
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def get_id(self, string):
+        string_id = self.ids.get(string, None)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+    def to_arrays(self):
+        return pack_strings(self.strings)
+
+# Packs strings as concatenated UTF-8 bytes and offsets; unlike a fixed-width NumPy string array
+# the size does not depend on the longest string
+def pack_strings(strings):
+    encoded = [x.encode('utf-8') for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+# Decodes the strings with the given ids (all strings by default) from packed data and offsets
+def unpack_strings(data, offsets, ids=None):
+    if ids is None:
+        ids = range(len(offsets) - 1)
+    data = memoryview(np.ascontiguousarray(data))
+    return [bytes(data[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in ids]
+
+def string_count(arrays):
+    return len(arrays["string_offsets"]) - 1
+
+def get_strings(arrays, ids=None):
+    return unpack_strings(arrays["string_data"], arrays["string_offsets"], ids)
+
+# Column lists that are filled while walking the KGML and converted to arrays at the end
+class EdgeListBuilder():
+
+    def __init__(self):
+        self.strings = StringTable()
+        self.pathways = []
+        self.node_name = []
+        self.node_type = []
+        self.node_pathway = []
+        self.edge_src = []
+        self.edge_dst = []
+        self.edge_type = []
+        self.edge_subtype = []
+        self.edge_pathway = []
+        self.group_entry = []
+        self.group_member = []
+
+    # Adds the entries, relations and reactions of one KGML file
+    def add_kgml(self, filename):
+        root = ElementTree.parse(filename).getroot()
+        pathid = root.get("name", path.splitext(path.basename(filename))[0]).split(":")[-1]
+        pathway = len(self.pathways)
+        self.pathways.append(self.strings.get_id(pathid))
+
+        # KGML entry ids are only unique inside the file
+        nodes = {}
+        for entry in root.iter("entry"):
+            entry_type = entry.get("type")
+            nodes[entry.get("id")] = len(self.node_name)
+            self.node_name.append(self.strings.get_id(entry.get("name", "")))
+            self.node_type.append(NODE_TYPES.index(entry_type) if entry_type in NODE_TYPES else NODE_OTHER)
+            self.node_pathway.append(pathway)
+
+        for entry in root.iter("entry"):
+            for component in entry.iter("component"):
+                if component.get("id") in nodes:
+                    self.group_entry.append(nodes[entry.get("id")])
+                    self.group_member.append(nodes[component.get("id")])
+
+        for relation in root.iter("relation"):
+            src = nodes.get(relation.get("entry1"), None)
+            dst = nodes.get(relation.get("entry2"), None)
+            if src is None or dst is None or relation.get("type") not in EDGE_TYPES:
+                continue
+            subtype = ",".join(x.get("name", "") for x in relation.iter("subtype"))
+            self.add_edge(src, dst, EDGE_TYPES.index(relation.get("type")), subtype, pathway)
+
+        for reaction in root.iter("reaction"):
+            substrates = [nodes[x.get("id")] for x in reaction.iter("substrate") if x.get("id") in nodes]
+            products = [nodes[x.get("id")] for x in reaction.iter("product") if x.get("id") in nodes]
+            reversible = reaction.get("type") == "reversible"
+            for src in substrates:
+                for dst in products:
+                    self.add_edge(src, dst, EDGE_REACTION, reaction.get("name", ""), pathway)
+                    if reversible:
+                        self.add_edge(dst, src, EDGE_REACTION, reaction.get("name", ""), pathway)
+
+    def add_edge(self, src, dst, edge_type, subtype, pathway):
+        self.edge_src.append(src)
+        self.edge_dst.append(dst)
+        self.edge_type.append(edge_type)
+        self.edge_subtype.append(self.strings.get_id(subtype))
+        self.edge_pathway.append(pathway)
+
+    def to_arrays(self):
+        string_data, string_offsets = self.strings.to_arrays()
+        return dict(string_data=string_data,
+                    string_offsets=string_offsets,
+                    pathways=np.array(self.pathways, dtype=np.int32),
+                    node_name=np.array(self.node_name, dtype=np.int32),
+                    node_type=np.array(self.node_type, dtype=np.int8),
+                    node_pathway=np.array(self.node_pathway, dtype=np.int32),
+                    edge_src=np.array(self.edge_src, dtype=np.int32),
+                    edge_dst=np.array(self.edge_dst, dtype=np.int32),
+                    edge_type=np.array(self.edge_type, dtype=np.int8),
+                    edge_subtype=np.array(self.edge_subtype, dtype=np.int32),
+                    edge_pathway=np.array(self.edge_pathway, dtype=np.int32),
+                    group_entry=np.array(self.group_entry, dtype=np.int32),
+                    group_member=np.array(self.group_member, dtype=np.int32))
+
+# Returns the KGML files downloaded for an organism, e.g. hsa00010.xml
+def organism_kgml_files(orgid, directory="."):
+    return sorted(glob.glob(path.join(directory, orgid + "[0-9]*.xml")))
+
+# Files that cannot be read or parsed are reported and left out
+def build_edge_list(filenames):
+    builder = EdgeListBuilder()
+    for filename in filenames:
+        try:
+            builder.add_kgml(filename)
+        except (ElementTree.ParseError, OSError) as what:
+            print("Skipped " + filename + ": " + str(what))
+    return builder.to_arrays()
+
+# Saves the arrays as <filename>.npz, or with mmap=True as a directory <filename>/ of .npy files
+# which load_edge_list opens memory-mapped
+def save_edge_list(filename, arrays, mmap=False):
+    if not mmap:
+        np.savez(filename + ".npz", **arrays)
+        return filename + ".npz"
+    if not path.isdir(filename):
+        os.makedirs(filename)
+    for name in ARRAYS:
+        np.save(path.join(filename, name + ".npy"), arrays[name])
+    return filename
+
+# Arrays that older exports do not have are left out
+def load_edge_list(filename):
+    if path.isdir(filename):
+        return dict((name, np.load(path.join(filename, name + ".npy"), mmap_mode='r')) for name in ARRAYS
+                    if path.exists(path.join(filename, name + ".npy")))
+    if not filename.endswith(".npz"):
+        filename = filename + ".npz"
+    with np.load(filename) as data:
+        return dict((name, data[name]) for name in ARRAYS if name in data.files)
+
+# Exports one KGML file as <pathid>.edges.npz next to it
+def export_pathway(filename, mmap=False):
+    arrays = build_edge_list([filename])
+    return save_edge_list(path.splitext(filename)[0] + ".edges", arrays, mmap)
+
+# Exports the downloaded KGML files of an organism as <orgid>.edges.npz,
+# either all of them or only the given pathway ids
+def export_organism(orgid, directory=".", mmap=False, pathids=None):
+    if pathids is None:
+        filenames = organism_kgml_files(orgid, directory)
+    else:
+        filenames = [path.join(directory, pathid + ".xml") for pathid in pathids]
+    if not filenames:
+        return None
+    arrays = build_edge_list(filenames)
+    if len(arrays["pathways"]) == 0:
+        return None
+    return save_edge_list(path.join(directory, orgid + ".edges"), arrays, mmap)
+
+# Returns the edges kept by edge_types (all EDGE_TYPES by default) as node index arrays
+def select_edges(arrays, edge_types=None):
+    src = arrays["edge_src"]
+    dst = arrays["edge_dst"]
+    if edge_types is not None:
+        keep = np.isin(arrays["edge_type"], [EDGE_TYPES.index(x) for x in edge_types])
+        src = src[keep]
+        dst = dst[keep]
+    return src, dst
+
+# Compressed sparse row form of the edges src -> dst over n nodes:
+# the successors of node i are indices[indptr[i]:indptr[i+1]]
+def csr(src, dst, n):
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order]
+
+# Splits every entry into the ids of its name, so "hsa:5594 hsa:5595" gives two nodes and
+# entries of different pathways that share an id share its node.
+# A group entry also gets the nodes of its components, so relations of the group reach its members.
+# Returns the node names and the nodes of every entry in csr form:
+# the nodes of entry e are entry_nodes[entry_indptr[e]:entry_indptr[e+1]]
+def split_entries(arrays):
+    strings = get_strings(arrays)
+    names = []
+    node_ids = {}
+    entry_nodes = []
+    for entry, name_id in enumerate(arrays["node_name"]):
+        name = strings[name_id]
+        tokens = name.split()
+        # Group entries are all named "undefined"; they must not be merged with each other
+        if not tokens or name == "undefined":
+            pathway = strings[arrays["pathways"][arrays["node_pathway"][entry]]]
+            tokens = [pathway + ":" + (name or "entry") + ":" + str(entry)]
+        nodes = []
+        for token in tokens:
+            node = node_ids.get(token, None)
+            if node is None:
+                node = node_ids[token] = len(names)
+                names.append(token)
+            nodes.append(node)
+        entry_nodes.append(nodes)
+    # Exports written before groups were recorded have no group arrays
+    for group, member in zip(arrays.get("group_entry", ()), arrays.get("group_member", ())):
+        entry_nodes[group] = entry_nodes[group] + entry_nodes[member]
+    entry_indptr = np.zeros(len(entry_nodes) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in entry_nodes], out=entry_indptr[1:])
+    return names, entry_indptr, np.array([x for nodes in entry_nodes for x in nodes], dtype=np.int32)
+
+# Concatenates values[indptr[r]:indptr[r+1]] for all rows r and returns it together with
+# the position in rows that every value came from
+def expand_ranges(indptr, values, rows):
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) - offsets[owners] + starts[owners]
+    return values[positions], owners
+
+# Returns the node names (see split_entries) and the adjacency as csr arrays over them.
+# Every relation or reaction between two entries becomes an edge from each node of the first entry
+# to each node of the second; an edge that comes from several pathways is kept once.
+# edge_types can restrict the EDGE_TYPES used
+def adjacency(arrays, edge_types=None):
+    names, entry_indptr, entry_nodes = split_entries(arrays)
+    src, dst = select_edges(arrays, edge_types)
+    src_nodes, edges = expand_ranges(entry_indptr, entry_nodes, src)
+    dst_nodes, pairs = expand_ranges(entry_indptr, entry_nodes, dst[edges])
+    size = max(len(names), 1)
+    keys = np.unique(src_nodes[pairs].astype(np.int64) * size + dst_nodes)
+    indptr, indices = csr(keys // size, (keys % size).astype(np.int32), len(names))
+    return names, indptr, indices
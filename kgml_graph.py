@@ -0,0 +1,259 @@
+# -*- coding:utf-8 -*-
+
+####################################################################################################
+# Reachability and path queries over KGML relation and reaction graphs
+# A pathway (<pathid>.xml) or all KGML of an organism is compiled into compressed sparse row
+# arrays (see kgml_export.adjacency) and cached next to the KGML as <name>.graph.npz.
+# Nodes are single genes, compounds and maps: an entry "hsa:5594 hsa:5595" is split into two nodes,
+# so pathways of an organism connect through every gene they share.
+# Relations of a group entry also connect the genes of its <component> entries.
+# For small graphs the transitive closure is precomputed as packed bits.
+####################################################################################################
+
+import os
+
+from os import path
+
+import numpy as np
+
+import kgml_export
+
+# Graphs with up to this many nodes get a precomputed transitive closure
+CLOSURE_LIMIT = 4096
+
+class PathwayGraph():
+
+    def __init__(self, names, indptr, indices, closure=None):
+        self.names = names
+        self.indptr = indptr
+        self.indices = indices
+        self.closure = closure
+        self.reverse = None
+        self.lists = None
+        self.lookup = dict((name, i) for i, name in enumerate(names))
+
+    # Builds the graph from kgml_export arrays (see kgml_export.adjacency)
+    @classmethod
+    def from_edge_list(cls, arrays, edge_types=None, closure=None):
+        names, indptr, indices = kgml_export.adjacency(arrays, edge_types)
+        graph = cls(names, indptr, indices)
+        if closure or (closure is None and len(names) <= CLOSURE_LIMIT):
+            graph.compute_closure()
+        return graph
+
+    def __len__(self):
+        return len(self.names)
+
+    # Nodes of a gene, compound or map id; a whole entry name ("hsa:5594 hsa:5595") gives the nodes of its ids
+    def get_nodes(self, name):
+        nodes = [self.lookup[x] for x in name.split() if x in self.lookup]
+        if not nodes:
+            raise KeyError(name + " is not in the graph")
+        return np.array(nodes, dtype=np.int32)
+
+    # Predecessors in csr form, built on first use for the backward half of bidirectional searches
+    def get_reverse(self):
+        if self.reverse is None:
+            sources = np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.indptr))
+            self.reverse = kgml_export.csr(self.indices, sources, len(self))
+        return self.reverse
+
+    # Successors of all the given nodes, with the node each one was reached from
+    def expand(self, frontier):
+        successors, owners = kgml_export.expand_ranges(self.indptr, self.indices, frontier)
+        return successors, frontier[owners]
+
+    # Visits the unvisited successors of frontier at distance depth and returns them as the next frontier
+    def visit_level(self, frontier, depth, distance, parent):
+        successors, parents = self.expand(frontier)
+        new = distance[successors] < 0
+        frontier, first = np.unique(successors[new], return_index=True)
+        distance[frontier] = depth
+        parent[frontier] = parents[new][first]
+        return frontier
+
+    # Breadth-first search from the nodes of a name (or an array of node indices).
+    # Returns the distance of every node (-1 when unreachable) and the BFS parent of every node.
+    # With targets (node indices) the search stops after the first level that reaches one of them
+    def bfs(self, source, max_depth=None, targets=None):
+        frontier = self.get_nodes(source) if isinstance(source, str) else np.asarray(source, dtype=np.int32)
+        distance = np.full(len(self), -1, dtype=np.int32)
+        parent = np.full(len(self), -1, dtype=np.int32)
+        distance[frontier] = 0
+        depth = 0
+        while len(frontier) and (max_depth is None or depth < max_depth):
+            if targets is not None and (distance[targets] >= 0).any():
+                break
+            depth += 1
+            frontier = self.visit_level(frontier, depth, distance, parent)
+        return distance, parent
+
+    # Names downstream of source, excluding source itself
+    def downstream(self, source, max_depth=None):
+        distance, parent = self.bfs(source, max_depth)
+        return [self.names[i] for i in np.flatnonzero(distance > 0)]
+
+    def is_reachable(self, source, target):
+        if self.closure is not None:
+            rows = np.unpackbits(self.closure[self.get_nodes(source)], axis=1, count=len(self))
+            return bool(rows[:, self.get_nodes(target)].any())
+        return self.search(self.get_nodes(source), self.get_nodes(target)) is not None
+
+    # Shortest path (fewest edges) from source to target as a list of node names, or None
+    def shortest_path(self, source, target):
+        found = self.search(self.get_nodes(source), self.get_nodes(target))
+        if found is None:
+            return None
+        meeting, forward, backward = found
+        result = [meeting]
+        while forward[result[0]] >= 0:
+            result.insert(0, forward[result[0]])
+        while backward[result[-1]] >= 0:
+            result.append(backward[result[-1]])
+        return [self.names[i] for i in result]
+
+    # Bidirectional breadth-first search: whole levels are expanded from whichever side has the smaller
+    # frontier, forwards from sources and backwards from targets, until the two sides meet.
+    # Point-to-point searches usually touch few nodes, so plain lists and dicts are faster here than
+    # NumPy levels over arrays of the whole graph.
+    # Returns the meeting node on a shortest path and the parents of both searches, or None
+    def search(self, sources, targets):
+        if self.lists is None:
+            reverse_indptr, reverse_indices = self.get_reverse()
+            self.lists = ((self.indptr.tolist(), self.indices.tolist()),
+                          (reverse_indptr.tolist(), reverse_indices.tolist()))
+        parents = [dict((x, -1) for x in sources.tolist()), dict((x, -1) for x in targets.tolist())]
+        frontiers = [list(parents[0]), list(parents[1])]
+        side = 0
+        meeting = [x for x in frontiers[0] if x in parents[1]]
+        while not meeting and frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            indptr, indices = self.lists[side]
+            visited = parents[side]
+            other = parents[1 - side]
+            frontier = []
+            for node in frontiers[side]:
+                for successor in indices[indptr[node]:indptr[node + 1]]:
+                    if successor not in visited:
+                        visited[successor] = node
+                        frontier.append(successor)
+                        if successor in other:
+                            meeting.append(successor)
+            frontiers[side] = frontier
+        if not meeting:
+            return None
+        # Every meeting node of the level is as far from this side; take the one closest to the other side
+        return min(meeting, key=lambda x: self.depth(parents[1 - side], x)), parents[0], parents[1]
+
+    @staticmethod
+    def depth(parents, node):
+        depth = 0
+        while parents[node] >= 0:
+            node = parents[node]
+            depth += 1
+        return depth
+
+    # Transitive closure as one packed bit row per node: bit j of row i is set when j is reachable from i.
+    # The nodes of a strongly connected component share one row, and components are handled sinks first,
+    # so each row is its own members ORed with the finished rows of the components it points to
+    def compute_closure(self):
+        component, count = self.strongly_connected_components()
+        members = np.argsort(component, kind='stable')
+        members_indptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(component, minlength=count), out=members_indptr[1:])
+        rows = np.zeros((count, len(self)), dtype=bool)
+        rows[component, np.arange(len(self))] = True
+        closure = np.packbits(rows, axis=1)
+        for c in range(count):
+            successors, owners = kgml_export.expand_ranges(self.indptr, self.indices,
+                                                           members[members_indptr[c]:members_indptr[c + 1]])
+            reached = np.unique(component[successors])
+            reached = reached[reached != c]
+            if len(reached):
+                closure[c] |= np.bitwise_or.reduce(closure[reached], axis=0)
+        self.closure = closure[component]
+
+    # Tarjan's algorithm without recursion. Returns the component of every node and the number of
+    # components; components are numbered in reverse topological order (a component only points to lower numbers)
+    def strongly_connected_components(self):
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        order = [-1] * len(self)
+        low = [0] * len(self)
+        on_stack = [False] * len(self)
+        component = [-1] * len(self)
+        stack = []
+        visited = 0
+        count = 0
+        for root in range(len(self)):
+            if order[root] >= 0:
+                continue
+            order[root] = low[root] = visited
+            visited += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [[root, indptr[root]]]
+            while work:
+                node, position = work[-1]
+                if position < indptr[node + 1]:
+                    work[-1][1] += 1
+                    successor = indices[position]
+                    if order[successor] < 0:
+                        order[successor] = low[successor] = visited
+                        visited += 1
+                        stack.append(successor)
+                        on_stack[successor] = True
+                        work.append([successor, indptr[successor]])
+                    elif on_stack[successor]:
+                        low[node] = min(low[node], order[successor])
+                    continue
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == order[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = count
+                        if member == node:
+                            break
+                    count += 1
+        return np.array(component, dtype=np.int32), count
+
+    def save(self, filename):
+        name_data, name_offsets = kgml_export.pack_strings(self.names)
+        arrays = dict(name_data=name_data, name_offsets=name_offsets, indptr=self.indptr, indices=self.indices)
+        if self.closure is not None:
+            arrays["closure"] = self.closure
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            closure = data["closure"] if "closure" in data.files else None
+            names = kgml_export.unpack_strings(data["name_data"], data["name_offsets"])
+            return cls(names, data["indptr"], data["indices"], closure)
+
+# Returns the graph of a pathway id (e.g. "hsa04010") or of a whole organism (e.g. "hsa"),
+# from the <name>.graph.npz cache when it is newer than the KGML it was compiled from
+def compile_graph(name, directory=".", edge_types=None, closure=None):
+    pathway = path.join(directory, name + ".xml")
+    if path.exists(pathway):
+        filenames = [pathway]
+    else:
+        filenames = kgml_export.organism_kgml_files(name, directory)
+    if not filenames:
+        raise IOError("No KGML found for " + name)
+
+    suffix = ".graph" + "".join("-" + x for x in sorted(edge_types or ()))
+    cache = path.join(directory, name + suffix + ".npz")
+    if path.exists(cache) and path.getmtime(cache) >= max(path.getmtime(x) for x in filenames):
+        graph = PathwayGraph.load(cache)
+        if not closure or graph.closure is not None:
+            return graph
+        graph.compute_closure()
+    else:
+        graph = PathwayGraph.from_edge_list(kgml_export.build_edge_list(filenames), edge_types, closure)
+    graph.save(cache + ".part.npz")
+    os.replace(cache + ".part.npz", cache)
+    return graph
@@ -0,0 +1,234 @@
+# -*- coding:utf-8 -*-
+
+####################################################################################################
+# Cross-organism KO presence/absence matrices
+# For every synced organism the KEGG orthologs (KOs) of the genes in its KGML are recorded as one
+# packed bit row (np.packbits), both organism-wide and per pathway map number (e.g. 04010),
+# so organisms can be compared without parsing the KGML again.
+# Organism KGML gene entries carry no KO, so genes are mapped with KEGG /link/ko/<orgid>,
+# which is cached as <orgid>.ko.tsv. Only these genes count as present. Ortholog entries ("ko:K00844")
+# of an organism map are the boxes the organism has no gene for; together with the mapped genes they
+# make up the reference KOs of the pathway, against which completeness is measured.
+####################################################################################################
+
+import os
+import re
+import time
+import http.client
+
+from os import path
+
+import numpy as np
+
+import kgml_export
+
+KO_MATRIX_FILE = "ko_matrix.npz"
+
+# How long (seconds) a cached <orgid>.ko.tsv is trusted before it is fetched again
+KO_LINKS_TTL = 7 * 24 * 60 * 60
+KO_LINKS_TIMEOUT = 60
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(x).count("1") for x in range(256)], dtype=np.uint8)
+
+# Bit matrix of organisms (rows) x KOs (packed columns); rows are added or replaced one organism at a time
+class PresenceMatrix():
+
+    def __init__(self, kos=(), organisms=(), bits=None):
+        self.kos = list(kos)
+        self.ko_index = dict((ko, i) for i, ko in enumerate(self.kos))
+        self.organisms = list(organisms)
+        self.org_index = dict((org, i) for i, org in enumerate(self.organisms))
+        if bits is None:
+            bits = np.zeros((len(self.organisms), (len(self.kos) + 7) // 8), dtype=np.uint8)
+        self.bits = bits
+
+    # Sets the KOs of an organism, adding KO columns and the organism row when they are new
+    def set_organism(self, orgid, kos):
+        for ko in kos:
+            if ko not in self.ko_index:
+                self.ko_index[ko] = len(self.kos)
+                self.kos.append(ko)
+        width = (len(self.kos) + 7) // 8
+        if width > self.bits.shape[1]:
+            self.bits = np.pad(self.bits, ((0, 0), (0, width - self.bits.shape[1])))
+        if orgid not in self.org_index:
+            self.org_index[orgid] = len(self.organisms)
+            self.organisms.append(orgid)
+            self.bits = np.vstack([self.bits, np.zeros((1, width), dtype=np.uint8)])
+        row = np.zeros(width * 8, dtype=bool)
+        row[[self.ko_index[ko] for ko in kos]] = True
+        self.bits[self.org_index[orgid]] = np.packbits(row)
+
+    def rows(self, orgids=None):
+        if orgids is None:
+            return self.bits
+        return self.bits[[self.org_index[org] for org in orgids]]
+
+    # Returns the KO names of the set bits of a packed row
+    def names(self, packed):
+        return [self.kos[i] for i in np.flatnonzero(np.unpackbits(packed, count=len(self.kos)))]
+
+    def count(self, orgids=None):
+        return POPCOUNT[self.rows(orgids)].sum(axis=1, dtype=np.int64)
+
+    # KOs present in all of the given organisms
+    def shared(self, orgids=None):
+        rows = self.rows(orgids)
+        if len(rows) == 0:
+            return []
+        return self.names(np.bitwise_and.reduce(rows, axis=0))
+
+    # KOs of orgid missing from all the other organisms (by default every other organism of the matrix)
+    def unique(self, orgid, others=None):
+        if others is None:
+            others = [org for org in self.organisms if org != orgid]
+        row = self.rows([orgid])[0]
+        if not others:
+            return self.names(row)
+        return self.names(row & ~np.bitwise_or.reduce(self.rows(others), axis=0))
+
+    # Pairwise Jaccard similarity; returns the organisms and the similarity matrix
+    def jaccard(self, orgids=None):
+        if orgids is None:
+            orgids = self.organisms
+        matrix = np.unpackbits(self.rows(orgids), axis=1, count=len(self.kos)).astype(np.float32)
+        intersection = matrix @ matrix.T
+        sizes = matrix.sum(axis=1)
+        union = sizes[:, None] + sizes[None, :] - intersection
+        similarity = np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+        return list(orgids), similarity
+
+# Organism-wide matrix plus one matrix per pathway map number, persisted in KO_MATRIX_FILE
+class KOMatrixEngine():
+
+    def __init__(self, filename=KO_MATRIX_FILE):
+        self.filename = filename
+        self.matrix = PresenceMatrix()
+        self.pathways = {}
+        # Reference KOs of every pathway map number, over all synced organisms
+        self.references = {}
+        if path.exists(filename):
+            self.load()
+
+    # Reads the KGML of an organism (or its <orgid>.edges export) and replaces the organism's rows
+    def update_organism(self, orgid, directory="."):
+        edges = path.join(directory, orgid + ".edges")
+        if path.exists(edges + ".npz") or path.isdir(edges):
+            arrays = kgml_export.load_edge_list(edges)
+        else:
+            filenames = kgml_export.organism_kgml_files(orgid, directory)
+            if not filenames:
+                return False
+            arrays = kgml_export.build_edge_list(filenames)
+        links = load_ko_links(orgid, directory)
+
+        strings = kgml_export.get_strings(arrays)
+        names = [strings[i] for i in arrays["pathways"]]
+        numbers = [re.sub("^[a-z]+", "", name) for name in names]
+        kos_by_pathway = dict((number, set()) for number in numbers)
+        for number in numbers:
+            self.references.setdefault(number, set())
+        for name_id, pathway in zip(arrays["node_name"], arrays["node_pathway"]):
+            kos = kos_by_pathway[numbers[pathway]]
+            reference = self.references[numbers[pathway]]
+            for name in strings[name_id].split():
+                if name.startswith("ko:"):
+                    reference.add(name[3:])
+                else:
+                    kos.update(links.get(name, ()))
+            reference.update(kos)
+
+        # Every synced organism has a row in every pathway matrix, empty when it lacks the pathway
+        for number in kos_by_pathway:
+            if number not in self.pathways:
+                self.pathways[number] = PresenceMatrix(organisms=self.matrix.organisms)
+        kos = set()
+        for number, matrix in self.pathways.items():
+            pathway_kos = kos_by_pathway.get(number, set())
+            kos.update(pathway_kos)
+            matrix.set_organism(orgid, sorted(pathway_kos))
+        self.matrix.set_organism(orgid, sorted(kos))
+        return True
+
+    def shared(self, orgids=None, pathway=None):
+        return self.get_matrix(pathway).shared(orgids)
+
+    def unique(self, orgid, others=None, pathway=None):
+        return self.get_matrix(pathway).unique(orgid, others)
+
+    def jaccard(self, orgids=None, pathway=None):
+        return self.get_matrix(pathway).jaccard(orgids)
+
+    # Fraction of the pathway's reference KOs present in each organism
+    def completeness(self, pathway, orgids=None):
+        matrix = self.get_matrix(pathway)
+        if orgids is None:
+            orgids = matrix.organisms
+        total = len(self.references.get(re.sub("^[a-z]+", "", pathway), ()))
+        if total == 0:
+            return list(orgids), np.zeros(len(orgids))
+        return list(orgids), matrix.count(orgids) / total
+
+    def get_matrix(self, pathway=None):
+        if pathway is None:
+            return self.matrix
+        return self.pathways[re.sub("^[a-z]+", "", pathway)]
+
+    def save(self):
+        arrays = dict(kos=np.array(self.matrix.kos, dtype=np.str_),
+                      organisms=np.array(self.matrix.organisms, dtype=np.str_),
+                      bits=self.matrix.bits,
+                      pathways=np.array(sorted(self.pathways), dtype=np.str_))
+        for number, matrix in self.pathways.items():
+            arrays["p" + number + "_kos"] = np.array(matrix.kos, dtype=np.str_)
+            arrays["p" + number + "_organisms"] = np.array(matrix.organisms, dtype=np.str_)
+            arrays["p" + number + "_bits"] = matrix.bits
+            arrays["p" + number + "_reference"] = np.array(sorted(self.references.get(number, ())), dtype=np.str_)
+        np.savez(self.filename, **arrays)
+
+    def load(self):
+        with np.load(self.filename) as data:
+            self.matrix = PresenceMatrix(data["kos"].tolist(), data["organisms"].tolist(), data["bits"])
+            self.pathways = {}
+            self.references = {}
+            for number in data["pathways"].tolist():
+                self.pathways[number] = PresenceMatrix(data["p" + number + "_kos"].tolist(),
+                                                       data["p" + number + "_organisms"].tolist(),
+                                                       data["p" + number + "_bits"])
+                self.references[number] = set(data["p" + number + "_reference"].tolist())
+
+# Returns the gene to KO mapping of an organism, e.g. {"hsa:3098": ["K00844"]},
+# from <orgid>.ko.tsv, fetching it from KEGG /link/ko/<orgid> first when it is missing or older than
+# KO_LINKS_TTL. A stale copy is still used when KEGG cannot be reached
+def load_ko_links(orgid, directory="."):
+    filename = path.join(directory, orgid + ".ko.tsv")
+    if not path.exists(filename) or time.time() - path.getmtime(filename) > KO_LINKS_TTL:
+        refresh_ko_links(orgid, filename)
+    links = {}
+    if not path.exists(filename):
+        return links
+    with open(filename, encoding='utf-8') as handle:
+        for line in handle:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) == 2:
+                links.setdefault(fields[0], []).append(fields[1].split(":")[-1])
+    return links
+
+def refresh_ko_links(orgid, filename):
+    conn = http.client.HTTPConnection('rest.kegg.jp', timeout=KO_LINKS_TIMEOUT)
+    try:
+        conn.request("GET", "/link/ko/" + orgid)
+        response = conn.getresponse()
+        if response.status != 200:
+            print("Could not get KO links for organism " + orgid)
+            return
+        body = response.read()
+    except (http.client.HTTPException, OSError):
+        print("Could not get KO links for organism " + orgid)
+        return
+    finally:
+        conn.close()
+    with open(filename + ".part", "wb") as handle:
+        handle.write(body)
+    os.replace(filename + ".part", filename)
@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+
+import sys
+
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+# hsa04010: gene 1 (two genes) activates gene 2, which links to map 00010;
+# a reversible reaction converts C00001 into C00002
+HSA04010 = """<?xml version="1.0"?>
+<!DOCTYPE pathway SYSTEM "https://www.kegg.jp/kegg/xml/KGML_v0.7.2_.dtd">
+<pathway name="path:hsa04010" org="hsa" number="04010">
+  <entry id="1" name="hsa:1 hsa:2" type="gene"/>
+  <entry id="2" name="hsa:3" type="gene"/>
+  <entry id="3" name="cpd:C00001" type="compound"/>
+  <entry id="4" name="cpd:C00002" type="compound"/>
+  <entry id="5" name="path:hsa00010" type="map"/>
+  <relation entry1="1" entry2="2" type="PPrel">
+    <subtype name="activation" value="--&gt;"/>
+    <subtype name="phosphorylation" value="+p"/>
+  </relation>
+  <relation entry1="2" entry2="5" type="maplink"/>
+  <reaction id="3" name="rn:R00001" type="reversible">
+    <substrate id="3" name="cpd:C00001"/>
+    <product id="4" name="cpd:C00002"/>
+  </reaction>
+</pathway>
+"""
+
+# hsa00010: gene 2 (shared with hsa04010 inside a multi-gene entry there) activates gene 9
+HSA00010 = """<?xml version="1.0"?>
+<pathway name="path:hsa00010" org="hsa" number="00010">
+  <entry id="1" name="hsa:2" type="gene"/>
+  <entry id="2" name="hsa:9" type="gene"/>
+  <entry id="3" name="ko:K00010" type="ortholog"/>
+  <relation entry1="1" entry2="2" type="ECrel"/>
+</pathway>
+"""
+
+ECO00010 = """<?xml version="1.0"?>
+<pathway name="path:eco00010" org="eco" number="00010">
+  <entry id="1" name="eco:b0001" type="gene"/>
+  <entry id="2" name="eco:b0002" type="gene"/>
+  <relation entry1="1" entry2="2" type="ECrel"/>
+</pathway>
+"""
+
+HSA_KO = "hsa:1\tko:K00001\nhsa:2\tko:K00002\nhsa:3\tko:K00003\nhsa:9\tko:K00009\n"
+ECO_KO = "eco:b0001\tko:K00001\neco:b0002\tko:K00004\n"
+
+@pytest.fixture
+def kgml_dir(tmp_path):
+    for name, content in (("hsa04010.xml", HSA04010), ("hsa00010.xml", HSA00010), ("eco00010.xml", ECO00010),
+                          ("hsa.ko.tsv", HSA_KO), ("eco.ko.tsv", ECO_KO)):
+        (tmp_path / name).write_text(content)
+    return str(tmp_path)
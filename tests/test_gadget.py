@@ -0,0 +1,204 @@
+# -*- coding:utf-8 -*-
+
+import pytest
+
+import gadget
+import garuda.garudaclientbackend as Garuda
+
+# Records the send requests instead of talking to Garuda Core
+class FakeBackend():
+
+    def __init__(self, gadgets=()):
+        self.sent = []
+        self.gadgets = list(gadgets)
+
+    def send_data_to_gadget(self, data, target_gadget_name, target_gadget_id, is_stream=False):
+        self.sent.append(target_gadget_id)
+
+    def get_compatible_gadget_list(self):
+        return self.gadgets
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(gadget.GarudaCommunicationHandler, "init_backend", lambda self: None)
+    app = gadget.GarudaCommunicationHandler("KeggClientGadget", "test")
+    app.backend = FakeBackend()
+    return app
+
+TARGETS = [Garuda.Gadget("A", "a"), Garuda.Gadget("B", "b")]
+
+def respond(app, code, gadget_id=None):
+    param = Garuda.Gadget(gadget_id.upper(), gadget_id) if gadget_id else None
+    app.garuda_message_handler(Garuda.ID_SEND_DATA_GADGET_RESPONSE, code, param)
+
+def test_all_targets_succeed(app):
+    app.send_data_to_gadgets(["x.xml"], TARGETS)
+    assert app.backend.sent == ["a", "b"]
+    respond(app, 200, "b")
+    assert app.loopBreak
+    respond(app, "200", "a")
+    assert not app.loopBreak
+    assert app.backend.sent == ["a", "b"]
+
+def test_only_failed_targets_are_retried(app):
+    app.send_data_to_gadgets(["x.xml"], TARGETS)
+    respond(app, 200, "a")
+    respond(app, 500, "b")
+    assert app.backend.sent == ["a", "b", "b"]
+    respond(app, 200, "b")
+    assert not app.loopBreak
+    assert sorted(app.fanoutSucceeded) == ["a", "b"]
+
+def test_retries_are_limited(app):
+    app.send_data_to_gadgets(["x.xml"], TARGETS[:1])
+    for attempt in range(app.fanoutRetries + 1):
+        respond(app, 500, "a")
+    assert app.backend.sent == ["a"] * (app.fanoutRetries + 1)
+    assert not app.loopBreak
+    assert app.fanoutSucceeded == {}
+
+def test_late_replies_are_ignored(app):
+    app.send_data_to_gadgets(["x.xml"], TARGETS)
+    respond(app, 200, "a")
+    respond(app, 500, "b")
+    # a duplicate of the first round must not close the retry round of b
+    respond(app, 200, "a")
+    assert app.loopBreak
+    respond(app, 200, "b")
+    assert not app.loopBreak
+    respond(app, 200)
+    assert app.backend.sent == ["a", "b", "b"]
+
+def test_untargeted_reply_for_single_pending_target(app):
+    app.send_data_to_gadgets(["x.xml"], TARGETS)
+    respond(app, 200, "a")
+    respond(app, 200)
+    assert not app.loopBreak
+    assert app.backend.sent == ["a", "b"]
+
+def test_untargeted_replies(app):
+    app.send_data_to_gadgets(["x.xml"], TARGETS)
+    respond(app, 200)
+    assert app.loopBreak
+    respond(app, 503)
+    # one of the two failed, but which one is unknown: both are sent again
+    assert app.backend.sent == ["a", "b", "a", "b"]
+
+def test_gadget_choices_are_replaced(app, monkeypatch):
+    app.backend.gadgets = TARGETS
+    monkeypatch.setattr("builtins.input", lambda prompt: "1")
+    app.garuda_message_handler(Garuda.ID_GET_COMPATIBLE_GADGET_LIST_RESPONSE, 200, None)
+    assert app.backend.sent == ["a"]
+    respond(app, 200, "a")
+    app.backend.gadgets = TARGETS[1:]
+    monkeypatch.setattr("builtins.input", lambda prompt: "a")
+    app.garuda_message_handler(Garuda.ID_GET_COMPATIBLE_GADGET_LIST_RESPONSE, 200, None)
+    assert app.backend.sent == ["a", "b"]
+    assert list(app.gadgetMap) == ["1"]
+
+KGML = b'<?xml version="1.0"?>\n<!DOCTYPE pathway SYSTEM "KGML.dtd">\n<pathway name="path:hsa00010"><entry id="1" name="hsa:1" type="gene"/></pathway>\n'
+
+# Answers every request with the given status, content type and body, or raises error
+def fake_kegg(monkeypatch, status=200, content_type="text/xml", body=KGML, error=None):
+    opened = []
+
+    class Response():
+        def __init__(self):
+            self.status = status
+            self.offset = 0
+        def getheader(self, name):
+            return content_type
+        def read(self, size=-1):
+            if error:
+                raise error
+            chunk = body[self.offset:self.offset + size]
+            self.offset += len(chunk)
+            return chunk
+
+    class Connection():
+        def __init__(self, host, timeout=None):
+            self.timeout = timeout
+            self.closed = False
+            opened.append(self)
+        def request(self, method, url):
+            self.url = url
+        def getresponse(self):
+            return Response()
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(gadget.http.client, "HTTPConnection", Connection)
+    return opened
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(gadget.time, "sleep", lambda seconds: None)
+    return tmp_path
+
+def test_fetch_kgml_ok(workdir, monkeypatch):
+    monkeypatch.setattr(gadget, "KGML_CHUNK_SIZE", 16)
+    opened = fake_kegg(monkeypatch, content_type="text/xml; charset=utf-8")
+    assert gadget.fetch_kgml("hsa00010")[0] == gadget.KGML_OK
+    assert (workdir / "hsa00010.xml").read_bytes() == KGML
+    assert opened[0].url == "/get/hsa00010/kgml"
+    assert opened[0].timeout == gadget.KGML_TIMEOUT
+    assert opened[0].closed
+
+@pytest.mark.parametrize("kwargs, expected", [
+    (dict(status=404, body=b""), gadget.KGML_NONE),
+    (dict(body=b""), gadget.KGML_NONE),
+    (dict(status=503), gadget.KGML_TRANSIENT),
+    (dict(status=429), gadget.KGML_TRANSIENT),
+    (dict(status=403), gadget.KGML_FATAL),
+    (dict(content_type="text/html"), gadget.KGML_FATAL),
+    (dict(body=b"<html><body>error</body></html>"), gadget.KGML_FATAL),
+    (dict(body=b"<pathway><entry></pathway>"), gadget.KGML_FATAL),
+    (dict(body=KGML[:60]), gadget.KGML_FATAL),
+    (dict(error=TimeoutError("timed out")), gadget.KGML_TRANSIENT),
+    (dict(error=gadget.http.client.IncompleteRead(b"")), gadget.KGML_TRANSIENT),
+])
+def test_fetch_kgml_classification(workdir, monkeypatch, kwargs, expected):
+    opened = fake_kegg(monkeypatch, **kwargs)
+    assert gadget.fetch_kgml("hsa00010")[0] == expected
+    assert sorted(x.name for x in workdir.iterdir()) == []
+    assert opened[0].closed
+
+def test_download_pathway_retries_transient(workdir, monkeypatch):
+    opened = fake_kegg(monkeypatch, status=503)
+    result, detail = gadget.download_pathway("hsa00010")
+    assert (result, detail) == (gadget.KGML_TRANSIENT, "HTTP 503")
+    assert len(opened) == gadget.KGML_RETRIES + 1
+    opened = fake_kegg(monkeypatch, status=404)
+    assert gadget.download_pathway("hsa00010")[0] == gadget.KGML_NONE
+    assert len(opened) == 1
+
+ORGANISMS = ("T01001\thsa\tHomo sapiens (human)\tEukaryotes;Animals;Vertebrates;Mammals\n"
+             "T01002\tptr\tPan troglodytes (chimpanzee)\tEukaryotes;Animals;Vertebrates;Mammals\n"
+             "T00007\teco\tEscherichia coli K-12 MG1655\tProkaryotes;Bacteria;Gammaproteobacteria\n"
+             "T05000\tecok\tEscherichia coli K-12\tProkaryotes;Bacteria;Gammaproteobacteria\n")
+
+@pytest.fixture
+def catalog(workdir):
+    (workdir / "organism_list.tsv").write_text(ORGANISMS)
+    return gadget.OrganismCatalog("organism_list.tsv")
+
+def test_catalog_expand(catalog):
+    assert catalog.expand("hsa, ecok") == (["hsa", "ecok"], [])
+    assert catalog.expand("HSA,Mammals,eco") == (["hsa", "ptr", "eco"], [])
+    assert catalog.expand("xyz, gammaproteobacteria") == (["eco", "ecok"], ["xyz"])
+    assert catalog.get_organism("PTR")[0] == "T01002"
+
+def test_catalog_refresh_failure_keeps_stale_cache(catalog, monkeypatch):
+    old = gadget.time.time() - gadget.ORGANISM_TTL - 60
+    gadget.os.utime(catalog.filename, (old, old))
+    opened = fake_kegg(monkeypatch, error=TimeoutError("timed out"))
+    assert catalog.expand("hsa") == (["hsa"], [])
+    assert opened[0].timeout == gadget.ORGANISM_TIMEOUT
+    assert opened[0].closed
+
+def test_catalog_unavailable_passes_codes_on(workdir, monkeypatch):
+    opened = fake_kegg(monkeypatch, status=503)
+    catalog = gadget.OrganismCatalog("organism_list.tsv")
+    assert catalog.expand("HSA") == (["HSA"], [])
+    assert opened[0].closed
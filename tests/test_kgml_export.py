@@ -0,0 +1,129 @@
+# -*- coding:utf-8 -*-
+
+from os import path
+
+import numpy as np
+
+import kgml_export
+
+def edges_by_name(arrays):
+    strings = kgml_export.get_strings(arrays)
+    names = [strings[i] for i in arrays["node_name"]]
+    return sorted((names[src], names[dst], kgml_export.EDGE_TYPES[edge_type])
+                  for src, dst, edge_type in zip(arrays["edge_src"], arrays["edge_dst"], arrays["edge_type"]))
+
+def test_pack_strings_roundtrip():
+    strings = ["", "hsa:1", "hsa:1 hsa:2 " * 50, "é"]
+    data, offsets = kgml_export.pack_strings(strings)
+    assert data.dtype == np.uint8
+    assert len(offsets) == len(strings) + 1
+    assert kgml_export.unpack_strings(data, offsets) == strings
+    assert kgml_export.unpack_strings(data, offsets, [2, 0]) == [strings[2], ""]
+
+def test_pack_strings_empty():
+    data, offsets = kgml_export.pack_strings([])
+    assert kgml_export.unpack_strings(data, offsets) == []
+
+def test_build_edge_list(kgml_dir):
+    arrays = kgml_export.build_edge_list([path.join(kgml_dir, "hsa04010.xml")])
+    assert kgml_export.get_strings(arrays, arrays["pathways"]) == ["hsa04010"]
+    assert len(arrays["node_name"]) == 5
+    assert edges_by_name(arrays) == [("cpd:C00001", "cpd:C00002", "reaction"),
+                                     ("cpd:C00002", "cpd:C00001", "reaction"),
+                                     ("hsa:1 hsa:2", "hsa:3", "PPrel"),
+                                     ("hsa:3", "path:hsa00010", "maplink")]
+    subtypes = kgml_export.get_strings(arrays, arrays["edge_subtype"][arrays["edge_type"] == 1])
+    assert subtypes == ["activation,phosphorylation"]
+
+def test_build_edge_list_skips_broken_files(kgml_dir):
+    broken = path.join(kgml_dir, "hsa99999.xml")
+    with open(broken, "w") as handle:
+        handle.write("<pathway><entry")
+    arrays = kgml_export.build_edge_list([broken, path.join(kgml_dir, "hsa00010.xml")])
+    assert kgml_export.get_strings(arrays, arrays["pathways"]) == ["hsa00010"]
+
+def test_export_organism_roundtrip(kgml_dir):
+    filename = kgml_export.export_organism("hsa", kgml_dir)
+    assert filename == path.join(kgml_dir, "hsa.edges.npz")
+    arrays = kgml_export.load_edge_list(filename)
+    assert sorted(kgml_export.get_strings(arrays, arrays["pathways"])) == ["hsa00010", "hsa04010"]
+    assert edges_by_name(arrays) == edges_by_name(kgml_export.build_edge_list(
+        kgml_export.organism_kgml_files("hsa", kgml_dir)))
+
+def test_export_organism_mmap(kgml_dir):
+    directory = kgml_export.export_organism("hsa", kgml_dir, mmap=True)
+    arrays = kgml_export.load_edge_list(directory)
+    assert isinstance(arrays["edge_src"], np.memmap)
+    assert len(arrays["edge_src"]) == 5
+
+def test_export_organism_selected_or_nothing(kgml_dir):
+    filename = kgml_export.export_organism("hsa", kgml_dir, pathids=["hsa00010"])
+    arrays = kgml_export.load_edge_list(filename)
+    assert kgml_export.get_strings(arrays, arrays["pathways"]) == ["hsa00010"]
+    assert kgml_export.export_organism("mmu", kgml_dir) is None
+
+def successor_names(names, indptr, indices):
+    return dict((names[i], sorted(names[j] for j in indices[indptr[i]:indptr[i + 1]]))
+                for i in range(len(names)) if indptr[i + 1] > indptr[i])
+
+def test_adjacency_csr(kgml_dir):
+    arrays = kgml_export.build_edge_list(kgml_export.organism_kgml_files("hsa", kgml_dir))
+    names, indptr, indices = kgml_export.adjacency(arrays)
+    assert len(indptr) == len(names) + 1
+    assert indptr[-1] == len(indices)
+    # hsa:2 is one node, shared by the multi-gene entry of hsa04010 and the entry of hsa00010
+    assert successor_names(names, indptr, indices) == {"hsa:1": ["hsa:3"],
+                                                       "hsa:2": ["hsa:3", "hsa:9"],
+                                                       "hsa:3": ["path:hsa00010"],
+                                                       "cpd:C00001": ["cpd:C00002"],
+                                                       "cpd:C00002": ["cpd:C00001"]}
+
+def test_adjacency_keeps_groups_apart(tmp_path):
+    for number, gene in (("00001", "hsa:10"), ("00002", "hsa:20")):
+        (tmp_path / ("hsa" + number + ".xml")).write_text(
+            '<pathway name="path:hsa%s"><entry id="1" name="undefined" type="group"/>'
+            '<entry id="2" name="%s" type="gene"/><relation entry1="1" entry2="2" type="PPrel"/></pathway>' % (number, gene))
+    arrays = kgml_export.build_edge_list(kgml_export.organism_kgml_files("hsa", str(tmp_path)))
+    successors = successor_names(*kgml_export.adjacency(arrays))
+    assert sorted(successors.values()) == [["hsa:10"], ["hsa:20"]]
+
+def test_adjacency_edge_types_and_empty(kgml_dir):
+    arrays = kgml_export.build_edge_list([path.join(kgml_dir, "hsa04010.xml")])
+    names, indptr, indices = kgml_export.adjacency(arrays, ["maplink"])
+    assert successor_names(names, indptr, indices) == {"hsa:3": ["path:hsa00010"]}
+    empty = kgml_export.build_edge_list([])
+    names, indptr, indices = kgml_export.adjacency(empty)
+    assert names == [] and list(indptr) == [0] and len(indices) == 0
+
+GROUP_KGML = '''<pathway name="path:hsa00003">
+  <entry id="1" name="hsa:31" type="gene"/>
+  <entry id="2" name="hsa:32 hsa:33" type="gene"/>
+  <entry id="3" name="undefined" type="group"><component id="1"/><component id="2"/></entry>
+  <entry id="4" name="hsa:34" type="gene"/>
+  <entry id="5" name="hsa:35" type="gene"/>
+  <relation entry1="3" entry2="4" type="PPrel"/>
+  <relation entry1="5" entry2="3" type="PPrel"/>
+</pathway>'''
+
+def test_group_components(tmp_path):
+    (tmp_path / "hsa00003.xml").write_text(GROUP_KGML)
+    arrays = kgml_export.build_edge_list([str(tmp_path / "hsa00003.xml")])
+    assert list(arrays["group_entry"]) == [2, 2]
+    assert list(arrays["group_member"]) == [0, 1]
+    saved = kgml_export.save_edge_list(str(tmp_path / "hsa.edges"), arrays)
+    assert list(kgml_export.load_edge_list(saved)["group_member"]) == [0, 1]
+    successors = successor_names(*kgml_export.adjacency(arrays))
+    for member in ("hsa:31", "hsa:32", "hsa:33"):
+        assert successors[member] == ["hsa:34"]
+    assert successors["hsa:35"] == ["hsa00003:undefined:2", "hsa:31", "hsa:32", "hsa:33"]
+    # members are not connected to each other
+    assert "hsa:31" not in successors["hsa:32"]
+
+def test_load_export_without_groups(tmp_path):
+    (tmp_path / "hsa00003.xml").write_text(GROUP_KGML)
+    arrays = kgml_export.build_edge_list([str(tmp_path / "hsa00003.xml")])
+    del arrays["group_entry"], arrays["group_member"]
+    np.savez(str(tmp_path / "old.npz"), **arrays)
+    loaded = kgml_export.load_edge_list(str(tmp_path / "old"))
+    assert "group_entry" not in loaded
+    assert successor_names(*kgml_export.adjacency(loaded))["hsa:35"] == ["hsa00003:undefined:2"]
@@ -0,0 +1,165 @@
+# -*- coding:utf-8 -*-
+
+import os
+
+from os import path
+
+import numpy as np
+import pytest
+
+import kgml_export
+import kgml_graph
+
+def random_graph(n, m, seed=0):
+    rng = np.random.default_rng(seed)
+    arrays = kgml_export.build_edge_list([])
+    data, offsets = kgml_export.pack_strings(["n%d" % i for i in range(n)] + ["x"])
+    arrays.update(string_data=data, string_offsets=offsets,
+                  pathways=np.array([n], dtype=np.int32),
+                  node_name=np.arange(n, dtype=np.int32),
+                  node_type=np.zeros(n, dtype=np.int8),
+                  node_pathway=np.zeros(n, dtype=np.int32),
+                  edge_src=rng.integers(0, n, m).astype(np.int32),
+                  edge_dst=rng.integers(0, n, m).astype(np.int32),
+                  edge_type=np.zeros(m, dtype=np.int8))
+    return arrays
+
+def successors(graph, name):
+    i = graph.lookup[name]
+    return sorted(graph.names[j] for j in graph.indices[graph.indptr[i]:graph.indptr[i + 1]])
+
+def test_pathway_graph_csr(kgml_dir):
+    graph = kgml_graph.compile_graph("hsa04010", kgml_dir)
+    assert sorted(graph.names) == ["cpd:C00001", "cpd:C00002", "hsa:1", "hsa:2", "hsa:3", "path:hsa00010"]
+    assert len(graph.indptr) == len(graph) + 1
+    assert successors(graph, "hsa:1") == ["hsa:3"]
+    assert successors(graph, "hsa:2") == ["hsa:3"]
+    assert successors(graph, "cpd:C00002") == ["cpd:C00001"]
+    assert successors(graph, "path:hsa00010") == []
+
+def test_queries(kgml_dir):
+    graph = kgml_graph.compile_graph("hsa04010", kgml_dir)
+    assert sorted(graph.downstream("hsa:1")) == ["hsa:3", "path:hsa00010"]
+    assert graph.downstream("hsa:1", max_depth=1) == ["hsa:3"]
+    assert graph.shortest_path("hsa:1", "path:hsa00010") == ["hsa:1", "hsa:3", "path:hsa00010"]
+    assert graph.shortest_path("hsa:3", "hsa:1") is None
+    assert graph.is_reachable("hsa:1 hsa:2", "path:hsa00010")
+    assert not graph.is_reachable("hsa:1", "hsa:2")
+    with pytest.raises(KeyError):
+        graph.bfs("hsa:404")
+
+def test_organism_graph_connects_shared_genes(kgml_dir):
+    graph = kgml_graph.compile_graph("hsa", kgml_dir, closure=False)
+    assert graph.closure is None
+    assert graph.shortest_path("hsa:1", "hsa:9") is None
+    assert graph.shortest_path("hsa:2", "hsa:9") == ["hsa:2", "hsa:9"]
+    assert sorted(graph.downstream("hsa:2")) == ["hsa:3", "hsa:9", "path:hsa00010"]
+
+def test_edge_types(kgml_dir):
+    graph = kgml_graph.compile_graph("hsa04010", kgml_dir, edge_types=["PPrel"])
+    assert path.exists(path.join(kgml_dir, "hsa04010.graph-PPrel.npz"))
+    assert graph.downstream("hsa:1") == ["hsa:3"]
+    assert graph.downstream("cpd:C00001") == []
+
+def test_cache(kgml_dir):
+    graph = kgml_graph.compile_graph("hsa04010", kgml_dir)
+    cache = path.join(kgml_dir, "hsa04010.graph.npz")
+    cached = kgml_graph.compile_graph("hsa04010", kgml_dir)
+    assert cached.names == graph.names
+    assert np.array_equal(cached.indices, graph.indices)
+    assert np.array_equal(cached.closure, graph.closure)
+    os.utime(path.join(kgml_dir, "hsa04010.xml"), (path.getmtime(cache) + 10, path.getmtime(cache) + 10))
+    assert kgml_graph.compile_graph("hsa04010", kgml_dir).names == graph.names
+    with pytest.raises(IOError):
+        kgml_graph.compile_graph("mmu", kgml_dir)
+
+@pytest.mark.parametrize("n, m", [(1, 0), (50, 30), (200, 600)])
+def test_closure_agrees_with_bfs(n, m):
+    graph = kgml_graph.PathwayGraph.from_edge_list(random_graph(n, m), closure=True)
+    closure = np.unpackbits(graph.closure, axis=1, count=n).astype(bool)
+    for node in range(n):
+        distance, parent = graph.bfs([node])
+        assert np.array_equal(closure[node], distance >= 0)
+        for target in range(0, n, 7):
+            route = graph.shortest_path(graph.names[node], graph.names[target])
+            if distance[target] < 0:
+                assert route is None
+            else:
+                assert len(route) == distance[target] + 1
+                assert all(graph.lookup[b] in successors_of(graph, graph.lookup[a]) for a, b in zip(route, route[1:]))
+
+def successors_of(graph, i):
+    return set(graph.indices[graph.indptr[i]:graph.indptr[i + 1]].tolist())
+
+def test_empty_graph():
+    graph = kgml_graph.PathwayGraph.from_edge_list(kgml_export.build_edge_list([]))
+    assert len(graph) == 0
+    assert list(graph.indptr) == [0]
+    assert graph.closure.shape == (0, 0)
+
+def test_group_entries_are_not_merged(tmp_path):
+    for number, gene in (("00001", "hsa:1"), ("00002", "hsa:2")):
+        (tmp_path / ("hsa" + number + ".xml")).write_text(
+            '<pathway name="path:hsa%s"><entry id="1" name="undefined" type="group"/>'
+            '<entry id="2" name="%s" type="gene"/><relation entry1="1" entry2="2" type="PPrel"/></pathway>' % (number, gene))
+    graph = kgml_graph.compile_graph("hsa", str(tmp_path))
+    assert len(graph) == 4
+    assert not graph.is_reachable("hsa:1", "hsa:2")
+
+def graph_of(n, edges):
+    arrays = random_graph(n, 0)
+    arrays.update(edge_src=np.array([a for a, b in edges], dtype=np.int32),
+                  edge_dst=np.array([b for a, b in edges], dtype=np.int32),
+                  edge_type=np.zeros(len(edges), dtype=np.int8))
+    return kgml_graph.PathwayGraph.from_edge_list(arrays, closure=True)
+
+def test_closure_of_long_chain():
+    n = kgml_graph.CLOSURE_LIMIT
+    graph = graph_of(n, [(i, i + 1) for i in range(n - 1)])
+    closure = np.unpackbits(graph.closure, axis=1, count=n).astype(bool)
+    assert closure.sum() == n * (n + 1) // 2
+    assert graph.is_reachable("n0", "n%d" % (n - 1))
+    assert not graph.is_reachable("n%d" % (n - 1), "n0")
+
+def test_closure_with_cycles():
+    # cycle 0-1-2 points to cycle 3-4, which points to 5; 6 points into the first cycle
+    graph = graph_of(7, [(0, 1), (1, 2), (2, 0), (2, 3), (3, 4), (4, 3), (4, 5), (6, 1)])
+    component, count = graph.strongly_connected_components()
+    assert count == 4
+    assert component[0] == component[1] == component[2] != component[3] == component[4]
+    assert component[5] < component[3] < component[0] < component[6]
+    closure = np.unpackbits(graph.closure, axis=1, count=7).astype(bool)
+    assert [list(np.flatnonzero(row)) for row in closure] == \
+        [[0, 1, 2, 3, 4, 5]] * 3 + [[3, 4, 5]] * 2 + [[5], [0, 1, 2, 3, 4, 5, 6]]
+
+@pytest.mark.parametrize("n, m", [(1, 0), (50, 30), (200, 600)])
+def test_search_agrees_with_bfs(n, m):
+    graph = kgml_graph.PathwayGraph.from_edge_list(random_graph(n, m), closure=False)
+    assert graph.closure is None
+    for node in range(0, n, 3):
+        distance, parent = graph.bfs([node])
+        for target in range(0, n, 5):
+            source_name, target_name = graph.names[node], graph.names[target]
+            assert graph.is_reachable(source_name, target_name) == (distance[target] >= 0)
+            route = graph.shortest_path(source_name, target_name)
+            if distance[target] < 0:
+                assert route is None
+            else:
+                assert len(route) == distance[target] + 1
+                assert route[0] == source_name and route[-1] == target_name
+                assert all(graph.lookup[b] in successors_of(graph, graph.lookup[a]) for a, b in zip(route, route[1:]))
+
+def test_bfs_stops_at_targets():
+    graph = graph_of(6, [(i, i + 1) for i in range(5)])
+    distance, parent = graph.bfs("n0", targets=np.array([2]))
+    assert list(distance) == [0, 1, 2, -1, -1, -1]
+    assert graph.shortest_path("n1", "n1") == ["n1"]
+
+def test_group_members_get_group_edges(tmp_path):
+    (tmp_path / "hsa00003.xml").write_text(
+        '<pathway name="path:hsa00003"><entry id="1" name="hsa:31" type="gene"/>'
+        '<entry id="2" name="undefined" type="group"><component id="1"/></entry>'
+        '<entry id="3" name="hsa:34" type="gene"/><relation entry1="2" entry2="3" type="PPrel"/></pathway>')
+    graph = kgml_graph.compile_graph("hsa00003", str(tmp_path))
+    assert graph.downstream("hsa:31") == ["hsa:34"]
+    assert graph.shortest_path("hsa:31", "hsa:34") == ["hsa:31", "hsa:34"]
@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+
+import os
+import time
+
+from os import path
+
+import numpy as np
+import pytest
+
+import ko_matrix
+
+@pytest.fixture
+def engine(kgml_dir):
+    engine = ko_matrix.KOMatrixEngine(path.join(kgml_dir, "ko_matrix.npz"))
+    assert engine.update_organism("hsa", kgml_dir)
+    assert engine.update_organism("eco", kgml_dir)
+    return engine
+
+def test_presence_matrix_padding():
+    matrix = ko_matrix.PresenceMatrix()
+    matrix.set_organism("a", ["K%05d" % i for i in range(7)])
+    assert matrix.bits.shape == (1, 1)
+    matrix.set_organism("b", ["K%05d" % i for i in range(5, 12)])
+    assert matrix.bits.shape == (2, 2)
+    assert list(matrix.count()) == [7, 7]
+    assert matrix.shared() == ["K00005", "K00006"]
+    assert matrix.unique("a") == ["K%05d" % i for i in range(5)]
+    matrix.set_organism("a", [])
+    assert list(matrix.count()) == [0, 7]
+
+def test_organism_kos(engine):
+    # K00010 is an ortholog box of hsa00010, i.e. a KO hsa has no gene for
+    assert sorted(engine.matrix.names(engine.matrix.rows(["hsa"])[0])) == \
+        ["K00001", "K00002", "K00003", "K00009"]
+    assert engine.shared() == ["K00001"]
+    assert engine.unique("eco") == ["K00004"]
+    assert engine.shared(pathway="00010") == []
+    assert engine.shared(pathway="eco00010") == []
+
+def test_jaccard(engine):
+    orgids, similarity = engine.jaccard()
+    assert orgids == ["hsa", "eco"]
+    assert np.allclose(similarity, [[1.0, 1.0 / 5], [1.0 / 5, 1.0]])
+    orgids, similarity = engine.jaccard(pathway="04010")
+    assert np.allclose(similarity, [[1.0, 0.0], [0.0, 0.0]])
+
+def test_completeness_with_missing_pathway(engine):
+    orgids, completeness = engine.completeness("04010")
+    assert orgids == ["hsa", "eco"]
+    assert np.allclose(completeness, [1.0, 0.0])
+    # reference KOs of 00010: K00010 (ortholog box) plus the genes K00002, K00009 (hsa), K00001, K00004 (eco)
+    assert engine.references["00010"] == set(["K00001", "K00002", "K00004", "K00009", "K00010"])
+    orgids, completeness = engine.completeness("00010", ["eco", "hsa"])
+    assert np.allclose(completeness, [2.0 / 5, 2.0 / 5])
+    assert engine.unique("eco", pathway="04010") == []
+
+def test_pathway_added_after_organism(kgml_dir):
+    engine = ko_matrix.KOMatrixEngine(path.join(kgml_dir, "ko_matrix.npz"))
+    engine.update_organism("eco", kgml_dir)
+    engine.update_organism("hsa", kgml_dir)
+    assert engine.pathways["04010"].organisms == ["eco", "hsa"]
+    orgids, completeness = engine.completeness("04010")
+    assert np.allclose(completeness, [0.0, 1.0])
+
+def test_save_and_load(engine):
+    engine.save()
+    loaded = ko_matrix.KOMatrixEngine(engine.filename)
+    assert loaded.matrix.kos == engine.matrix.kos
+    assert np.array_equal(loaded.matrix.bits, engine.matrix.bits)
+    assert loaded.references == engine.references
+    assert np.allclose(loaded.completeness("00010")[1], engine.completeness("00010")[1])
+
+def test_load_ko_links_uses_stale_cache(kgml_dir, monkeypatch):
+    filename = path.join(kgml_dir, "hsa.ko.tsv")
+    old = time.time() - ko_matrix.KO_LINKS_TTL - 60
+    os.utime(filename, (old, old))
+    refreshed = []
+    monkeypatch.setattr(ko_matrix, "refresh_ko_links", lambda orgid, filename: refreshed.append(orgid))
+    links = ko_matrix.load_ko_links("hsa", kgml_dir)
+    assert refreshed == ["hsa"]
+    assert links["hsa:9"] == ["K00009"]
+    assert ko_matrix.load_ko_links("mmu", kgml_dir) == {}
+
+def test_refresh_ko_links_network_error(kgml_dir, monkeypatch):
+    class Unreachable():
+        def __init__(self, *args, **kwargs):
+            pass
+        def request(self, method, url):
+            raise OSError("unreachable")
+        def close(self):
+            pass
+    monkeypatch.setattr(ko_matrix.http.client, "HTTPConnection", Unreachable)
+    filename = path.join(kgml_dir, "mmu.ko.tsv")
+    ko_matrix.refresh_ko_links("mmu", filename)
+    assert not path.exists(filename)
+    assert not path.exists(filename + ".part")
+
+def test_ortholog_boxes_are_absent(kgml_dir):
+    engine = ko_matrix.KOMatrixEngine(path.join(kgml_dir, "ko_matrix.npz"))
+    engine.update_organism("hsa", kgml_dir)
+    assert engine.shared(pathway="00010") == ["K00002", "K00009"]
+    orgids, completeness = engine.completeness("00010")
+    assert np.allclose(completeness, [2.0 / 3])